@@ -1,8 +1,41 @@
 # app.py
-import logging
-from ui import run_app
+import argparse, json, logging, sys
+
+def replay_traces(paths, policies):
+    from config import load_config
+    from engine import load_trace, parse_policy, replay
+    events = sorted((e for p in paths for e in load_trace(p)), key=lambda e: e[0])
+    if not events:
+        print("No events in trace.")
+        return
+    cfg = load_config()
+    for spec in policies or [""]:
+        print(json.dumps(replay(events, cfg, parse_policy(spec))))
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="MDI AutoLogin")
+    ap.add_argument("--profile", action="store_true",
+                    help="enable sampling/tracemalloc profiling from launch (dumped on quit)")
+    ap.add_argument("--replay", nargs="+", metavar="TRACE",
+                    help="replay recorded trace file(s) instead of starting the app")
+    ap.add_argument("--policy", action="append", metavar="K=V,...",
+                    help="policy to evaluate with --replay, e.g. base_interval=10,retry_wait=3 "
+                         "(repeatable; default is the current config)")
+    args = ap.parse_args()
     logging.basicConfig(level=logging.INFO)
-    run_app()
-
+    if args.replay:
+        try:
+            replay_traces(args.replay, args.policy)
+        except (ValueError, OSError) as e:
+            ap.error(str(e))
+    else:
+        from instance import acquire_instance_lock, forward_to_running
+        if not acquire_instance_lock():
+            # already running for this user: hand the request over and exit
+            if args.profile:
+                forward_to_running("/profile/start")
+            if not forward_to_running("/panel/show"):
+                logging.getLogger("mdi").info("Another instance is running but did not answer.")
+            sys.exit(0)
+        from ui import run_app
+        run_app(profile=args.profile)
@@ -37,6 +37,13 @@ def load_config():
         "first_run": True,
         "auto_start_on_launch": True, 
         "dark_mode": False,
+        "ipc_enabled": True,
+        "ipc_port": 47800,
+        "profiling": False,
+        "record_trace": False,
+        "watchdog_stall_s": 180,
+        "speculative_login": True,
+        "probe_mode": "get",
     }
 
 def save_config(cfg): CONFIG_PATH.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
@@ -0,0 +1,359 @@
+# engine.py
+"""
+MDI AutoLogin - auto-login decision logic, trace recording and replay
+
+run_cycle() is one iteration of the worker loop. It only talks to the outside
+world through an "env", so the same logic runs against:
+  * LiveEnv   - real probes / login POST / wall clock (used by AutoLoginWorker),
+                optionally recording every result to a trace file;
+  * ReplayEnv - a recorded trace on a virtual clock, to compare scheduling
+                policies (base_interval, retry_wait, settle_*) offline.
+
+Trace files are JSON lines in app_dir()/traces/: {"t": <epoch>, "ev": "detect" |
+"online" | "login", "v": <bool>}.
+"""
+
+import json, time, random, bisect, threading, logging
+from pathlib import Path
+from statistics import median
+
+from config import app_dir
+from state import AppState, STATE
+from net import connected_to_target, online_now, send_login, prewarm_login_async
+
+log = logging.getLogger("mdi")
+
+TRACE_DIR = app_dir() / "traces"
+POLICY_KEYS = ("base_interval", "retry_wait", "settle_max", "settle_step")
+DEFAULT_LOGIN_LATENCY = 1.0
+TRACE_GAP_S = 900       # no events for this long: the app wasn't running
+
+# ---------- login coordination ----------
+class SingleFlight:
+    """Runs at most one call at a time; callers arriving while it is in flight
+    wait for it and get the same result (or exception) instead of starting another."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def do(self, fn, wait_timeout: float = None):
+        """Followers give up with TimeoutError after wait_timeout seconds."""
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = {"done": threading.Event(), "result": None, "error": None,
+                                         "owner": threading.get_ident()}
+        if not leader:
+            if not flight["done"].wait(wait_timeout):
+                raise TimeoutError("login attempt in flight did not finish")
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
+        try:
+            flight["result"] = fn()
+        except BaseException as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                if self._flight is flight:
+                    self._flight = None
+            flight["done"].set()
+        return flight["result"]
+
+    def abandon(self, owner: int) -> bool:
+        """Forget the in-flight call if thread `owner` is running it (e.g. a hung
+        worker being replaced), so new callers start afresh instead of joining it."""
+        with self._lock:
+            if self._flight is None or self._flight["owner"] != owner:
+                return False
+            self._flight = None
+            return True
+
+# shared by the worker, tray and control panel so only one portal login runs at once
+LOGIN_FLIGHT = SingleFlight()
+
+# ---------- decision logic ----------
+def settle(env, max_s: float, step: float) -> bool:
+    """Same as net.settle_until_online, but on the env's clock."""
+    waited = 0.0
+    while waited < max_s and not env.stopped():
+        if env.online(): return True
+        env.sleep(step); waited += step
+    return False
+
+def attempt_login(env, cfg, username: str, password: str):
+    """POST credentials, then wait for the portal to let traffic through.
+    Returns (sent, settled); concurrent callers on the same env.flight share one attempt."""
+    def _attempt():
+        ok = env.login(username, password)
+        env.state.incr("logins_sent" if ok else "login_failures")
+        settled = ok and settle(env, cfg["settle_max"], cfg["settle_step"])
+        env.state.update(last_login=env.now(), last_login_ok=settled)
+        if settled:
+            env.state.incr("online_confirmed")
+            env.state.update(network="online", last_check=env.now())
+        return ok, settled
+    try:
+        return env.flight.do(_attempt, wait_timeout=cfg.get("watchdog_stall_s", 180))
+    except TimeoutError as e:
+        env.log.info("⏳ %s; giving up on it.", e)
+        return False, False
+
+def run_cycle(env, cfg, username: str, password: str) -> float:
+    """One worker iteration; returns how long to sleep before the next one."""
+    env.state.incr("cycles")
+    if env.connected():
+        # just joined: get the portal connection ready while the probe below is
+        # still in flight (not every cycle of a long captive spell, to spare the portal)
+        if cfg.get("speculative_login", True) and env.state.snapshot()["network"] in ("unknown", "offline"):
+            env.prewarm()
+        if not env.online():
+            env.state.update(network="captive", last_check=env.now())
+            env.log.info("🔒 Logged out. Attempting login…")
+            _, settled = attempt_login(env, cfg, username, password)
+            if settled:
+                env.log.info("✅ Online confirmed.")
+            else:
+                env.log.info("⏳ Portal still intercepting; will retry.")
+                env.sleep(cfg["retry_wait"])
+        else:
+            env.state.update(network="online", last_check=env.now())
+            env.log.info("✅ Already online.")
+    else:
+        env.state.update(network="offline", last_check=env.now())
+        env.log.info("📶 Not on %s (or still acquiring).", cfg["ssid"])
+    return max(1.0, cfg["base_interval"] + env.uniform(-1, 1))
+
+# ---------- recording ----------
+class TraceRecorder:
+    """Appends detector / probe / login results to a daily JSONL trace
+    (the file rolls over at midnight)."""
+
+    # shared so the worker and manual logins never interleave partial lines
+    _lock = threading.Lock()
+
+    def __init__(self, directory: Path = TRACE_DIR):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+
+    def path_for(self, t: float) -> Path:
+        return self.directory / time.strftime("trace-%Y%m%d.jsonl", time.localtime(t))
+
+    def record(self, ev: str, value: bool):
+        now = time.time()
+        line = json.dumps({"t": round(now, 3), "ev": ev, "v": bool(value)})
+        with self._lock:
+            try:
+                with open(self.path_for(now), "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                log.debug("trace write failed: %s", e)
+
+class LiveEnv:
+    def __init__(self, cfg, stop_event: threading.Event = None, recorder: TraceRecorder = None):
+        self.cfg = cfg
+        self.stop_event = stop_event or threading.Event()
+        self.recorder = recorder
+        self.state = STATE
+        self.log = log
+        self.flight = LOGIN_FLIGHT
+        self.on_sleep = None    # called with the duration before every sleep
+
+    def _rec(self, ev, value):
+        if self.recorder: self.recorder.record(ev, value)
+        return value
+
+    def now(self) -> float: return time.time()
+    def uniform(self, a, b) -> float: return random.uniform(a, b)
+
+    def sleep(self, seconds: float):
+        # interruptible so stop() takes effect quickly
+        if self.on_sleep: self.on_sleep(seconds)
+        self.stop_event.wait(seconds)
+
+    def stopped(self) -> bool: return self.stop_event.is_set()
+
+    def connected(self) -> bool: return self._rec("detect", connected_to_target(self.cfg))
+    def online(self) -> bool: return self._rec("online", online_now(self.cfg))
+    def login(self, username, password) -> bool:
+        return self._rec("login", send_login(self.cfg, username, password))
+
+    def prewarm(self):
+        """Non-blocking: pre-resolve and pre-connect (TLS) to the login portal."""
+        prewarm_login_async(self.cfg)
+
+# ---------- replay ----------
+def load_trace(path) -> list:
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                e = json.loads(line)
+                events.append((float(e["t"]), e["ev"], bool(e["v"])))
+            except (ValueError, KeyError, TypeError):
+                continue
+    events.sort(key=lambda e: e[0])
+    return events
+
+class _Series:
+    """Step function over time built from (t, value) points."""
+    def __init__(self, points, default: bool = False):
+        self.ts = [t for t, _ in points]
+        self.vs = [v for _, v in points]
+        self.default = default
+
+    def at(self, t: float) -> bool:
+        i = bisect.bisect_right(self.ts, t) - 1
+        return self.vs[i] if i >= 0 else self.default
+
+class ReplayEnv:
+    """Drives run_cycle against a recorded trace on a virtual clock.
+
+    Ground truth comes from the recording: "detect" gives whether we were on
+    campus, "online" whether traffic got through. Each recorded outage is either
+    login-resolved (the recorder logged in before it ended) or natural. After a
+    login-resolved outage starts, the replayed policy is offline until its own
+    first successful login since then plus the login latency measured in the
+    trace; natural outages are offline whatever the policy does.
+
+    Gaps of more than gap_s without events (nights, days the app wasn't
+    running) split the trace into sessions; only sessions are replayed.
+    """
+
+    def __init__(self, events: list, seed: int = 0, gap_s: float = TRACE_GAP_S):
+        self.log = logging.getLogger("mdi.replay")
+        self.log.propagate = False
+        self.state = AppState()
+        self.flight = SingleFlight()
+        self.rng = random.Random(seed)
+        self.start = events[0][0] if events else 0.0
+        self.end = events[-1][0] if events else 0.0
+        self.clock = self.start
+        self.sessions = []      # [(start, end)] of contiguous recording
+        for t, _, _ in events:
+            if self.sessions and t - self.sessions[-1][1] <= gap_s:
+                self.sessions[-1][1] = t
+            else:
+                self.sessions.append([t, t])
+        self.detect = _Series([(t, v) for t, ev, v in events if ev == "detect"])
+        self._build_outages(events)
+        self.logins = []        # successful replay login times, ascending
+        self.requests = {"detect": 0, "probe": 0, "login": 0}
+
+    def _build_outages(self, events):
+        login_ts = [t for t, ev, v in events if ev == "login" and v]
+        outages, latencies = [], []
+        start = None
+        session_ends = iter(end for _, end in self.sessions)
+        session_end = next(session_ends, self.end)
+        for t, ev, v in events:
+            if t > session_end:
+                # the recording stopped mid-outage; nothing is known after that
+                if start is not None:
+                    outages.append((start, session_end, False))
+                    start = None
+                session_end = next(session_ends, self.end)
+            if ev != "online": continue
+            if not v and start is None:
+                start = t
+            elif v and start is not None:
+                k = bisect.bisect_right(login_ts, t) - 1
+                by_login = k >= 0 and login_ts[k] >= start
+                outages.append((start, t, by_login))
+                if by_login: latencies.append(t - login_ts[k])
+                start = None
+        if start is not None:
+            outages.append((start, self.end, False))
+        self.outages = outages
+        self.natural = [(a, b) for a, b, by_login in outages if not by_login]
+        self.natural_starts = [a for a, _ in self.natural]
+        self.login_needed = [a for a, _, by_login in outages if by_login]
+        self.latency = median(latencies) if latencies else DEFAULT_LOGIN_LATENCY
+
+    def truth_online(self, t: float) -> bool:
+        k = bisect.bisect_right(self.natural_starts, t) - 1
+        if k >= 0 and t < self.natural[k][1]:
+            return False
+        i = bisect.bisect_right(self.login_needed, t) - 1
+        if i < 0:
+            return True
+        j = bisect.bisect_left(self.logins, self.login_needed[i])
+        return j < len(self.logins) and t >= self.logins[j] + self.latency
+
+    def now(self) -> float: return self.clock
+    def uniform(self, a, b) -> float: return self.rng.uniform(a, b)
+    def sleep(self, seconds: float): self.clock += seconds
+    def stopped(self) -> bool: return False
+
+    def connected(self) -> bool:
+        self.requests["detect"] += 1
+        return self.detect.at(self.clock)
+
+    def online(self) -> bool:
+        self.requests["probe"] += 1
+        return self.truth_online(self.clock)
+
+    def prewarm(self): pass
+
+    def login(self, username, password) -> bool:
+        self.requests["login"] += 1
+        ok = self.detect.at(self.clock)
+        if ok: bisect.insort(self.logins, self.clock)
+        return ok
+
+def replay(events: list, cfg: dict, policy: dict = None, seed: int = 0, resolution: float = 1.0,
+           gap_s: float = TRACE_GAP_S) -> dict:
+    """Run the worker logic over every recorded session of a trace; returns time
+    offline and request counts."""
+    pcfg = dict(cfg, **(policy or {}))
+    check_policy(pcfg)
+    env = ReplayEnv(events, seed=seed, gap_s=gap_s)
+    offline = 0.0
+    for start, end in env.sessions:
+        # a fresh launch: the worker knows nothing about the network yet
+        env.clock = max(env.clock, start)
+        env.state.update(network="unknown")
+        while env.clock < end:
+            env.sleep(run_cycle(env, pcfg, "", ""))
+        t = start
+        while t < end:
+            if env.detect.at(t) and not env.truth_online(t):
+                offline += resolution
+            t += resolution
+    return {
+        "policy": {k: pcfg[k] for k in POLICY_KEYS},
+        "duration_s": round(sum(end - start for start, end in env.sessions), 1),
+        "sessions": len(env.sessions),
+        "offline_s": round(offline, 1),
+        "cycles": env.state.metrics()["cycles"],
+        "requests": dict(env.requests, total=sum(env.requests.values())),
+    }
+
+def check_policy(policy: dict):
+    """Reject values that would stall the virtual clock (settle() never advancing)."""
+    for key in POLICY_KEYS:
+        if key not in policy: continue
+        value = policy[key]
+        if key == "settle_step" and value <= 0:
+            raise ValueError(f"settle_step must be > 0 (got {value})")
+        if value < 0:
+            raise ValueError(f"{key} must not be negative (got {value})")
+
+def parse_policy(spec: str) -> dict:
+    """'base_interval=5,retry_wait=3' -> {'base_interval': 5.0, 'retry_wait': 3.0}"""
+    policy = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, value = part.partition("=")
+        if key not in POLICY_KEYS:
+            raise ValueError(f"unknown policy key {key!r} (expected one of {', '.join(POLICY_KEYS)})")
+        try:
+            policy[key] = float(value)
+        except ValueError:
+            raise ValueError(f"{key} needs a number (got {value!r})") from None
+    check_policy(policy)
+    return policy
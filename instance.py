@@ -0,0 +1,108 @@
+# instance.py
+"""
+MDI AutoLogin - single-instance coordination
+
+* Per user: an exclusive lock on app_dir()/instance.lock. A second launch
+  (autostart + manual start, double-click, ...) forwards its request to the
+  running instance over the control API and exits, so there is only ever one
+  worker and one writer of the log file.
+* Per machine: the instance that owns the configured control-API port is the
+  leader and runs auto-login. Instances in other user sessions follow the
+  leader's /events stream and mirror its state instead of probing, and take
+  over when the leader goes away.
+"""
+
+import sys, json, time, threading, logging, http.client
+
+from config import app_dir
+from state import STATE
+from ipc import IPC_INFO_PATH
+
+log = logging.getLogger("mdi.instance")
+
+INSTANCE_LOCK_PATH = app_dir() / "instance.lock"
+MIRRORED_FIELDS = ("network", "health", "health_reason", "last_check", "last_login", "last_login_ok")
+
+_lock_file = None   # kept open for the life of the process
+
+def acquire_instance_lock() -> bool:
+    """True if this is the only running instance for the current user."""
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    f = open(INSTANCE_LOCK_PATH, "a+")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+def forward_to_running(path: str, wait_s: float = 10.0) -> bool:
+    """POST `path` to this user's running instance. Retries for a while because
+    the other instance may still be starting up and not have written ipc.json."""
+    deadline = time.time() + wait_s
+    while True:
+        try:
+            info = json.loads(IPC_INFO_PATH.read_text(encoding="utf-8"))
+            conn = http.client.HTTPConnection(info["host"], info["port"], timeout=5)
+            conn.request("POST", path, headers={"X-MDI-Token": info["token"]})
+            ok = conn.getresponse().status == 200
+            conn.close()
+            if ok:
+                return True
+        except (OSError, ValueError, KeyError):
+            pass
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.5)
+
+class LeaderFollower(threading.Thread):
+    """Mirrors the leader's state from its /events stream into STATE. When the
+    leader can't be reached, calls on_leader_lost(self) and exits."""
+
+    def __init__(self, port: int, on_leader_lost):
+        super().__init__(daemon=True, name="leader-follower")
+        self.port = port
+        self.on_leader_lost = on_leader_lost
+        self.connected = False      # did a leader ever answer?
+        self._halt = threading.Event()
+
+    def stop(self): self._halt.set()
+
+    def run(self):
+        try:
+            self._follow()
+        except Exception as e:
+            log.info("👥 Lost leader on port %s: %s", self.port, e)
+        if not self._halt.is_set():
+            self.on_leader_lost(self)
+
+    def _follow(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        conn.request("GET", "/events")
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise OSError(f"unexpected status {resp.status}")
+        while not self._halt.is_set():
+            line = resp.readline()
+            if not line:
+                raise OSError("leader closed the event stream")
+            if not line.strip():
+                continue    # keepalive
+            snap = json.loads(line)
+            if not self.connected:
+                if "version" not in snap:
+                    raise ValueError("not an MDI AutoLogin event stream")
+                self.connected = True
+                log.info("👥 Following the auto-login leader on port %s.", self.port)
+            STATE.update(leader_worker=snap.get("worker"),
+                         **{k: snap.get(k) for k in MIRRORED_FIELDS if k in snap})
+        conn.close()
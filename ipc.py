@@ -0,0 +1,171 @@
+# ipc.py
+"""
+MDI AutoLogin - local control / status API
+
+Small JSON-over-HTTP server bound to 127.0.0.1 so scripts and monitoring
+agents can read the running instance's cached state instead of probing the
+network themselves. The chosen endpoint and an access token are written to
+ipc.json in app_dir().
+
+The instance that owns the configured port is the machine-wide leader (see
+instance.py); others fall back to an ephemeral port until they can take over.
+
+  GET  /status           current status snapshot
+  GET  /metrics          counters since launch
+  GET  /events[?since=N] newline-delimited JSON, one snapshot per state change
+  POST /worker/start     start auto-login        (token required)
+  POST /worker/stop      stop auto-login         (token required)
+  POST /login            manual login attempt    (token required)
+  POST /profile/start    start profiling         (token required)
+  POST /profile/stop     stop profiling + dump   (token required)
+  POST /panel/show       open the control panel  (token required)
+
+POST requests must carry the token from ipc.json in an X-MDI-Token header.
+"""
+
+import json, os, sys, secrets, threading, logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from config import app_dir
+from state import STATE
+
+log = logging.getLogger("mdi.ipc")
+
+IPC_INFO_PATH = app_dir() / "ipc.json"
+DEFAULT_IPC_PORT = 47800
+EVENT_KEEPALIVE_S = 15
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MDIAutoLogin"
+
+    def log_message(self, fmt, *args):
+        log.debug("ipc: " + fmt, *args)
+
+    def _send_json(self, code: int, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/status":
+            self._send_json(200, STATE.snapshot())
+        elif url.path == "/metrics":
+            self._send_json(200, STATE.metrics())
+        elif url.path == "/events":
+            since = parse_qs(url.query).get("since", [None])[0]
+            self._stream_events(int(since) if since and since.isdigit() else None)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.headers.get("X-MDI-Token") != self.server.token:
+            self._send_json(403, {"error": "bad token"})
+            return
+        action = self.server.actions.get(urlparse(self.path).path)
+        if action is None:
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            self._send_json(200, {"ok": True, "result": action()})
+        except Exception as e:
+            log.exception("IPC action %s failed", self.path)
+            self._send_json(500, {"error": str(e)})
+
+    def _stream_events(self, since):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        snap = STATE.snapshot()
+        try:
+            # send the current state first unless the client is already up to date
+            if since != snap["version"]:
+                self._write_line(snap)
+            version = snap["version"]
+            while not self.server.stopping.is_set():
+                snap = STATE.wait_change(version, EVENT_KEEPALIVE_S, cancel=self.server.stopping)
+                if self.server.stopping.is_set():
+                    break
+                if snap is None:
+                    self.wfile.write(b"\n")  # keepalive; also detects closed clients
+                    self.wfile.flush()
+                    continue
+                version = snap["version"]
+                self._write_line(snap)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+    def _write_line(self, obj):
+        self.wfile.write(json.dumps(obj).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # on Windows SO_REUSEADDR lets a second process bind the same port, which
+    # would break both the fallback below and leader election
+    allow_reuse_address = sys.platform != "win32"
+
+class ControlServer:
+    """Runs the local API on daemon threads. `actions` maps POST paths to callables.
+    is_leader is True while this instance owns the configured port."""
+
+    def __init__(self, actions: dict, port: int = DEFAULT_IPC_PORT):
+        self.actions = actions
+        self.fixed_port = port
+        self.port = None
+        self.is_leader = False
+        self.token = secrets.token_urlsafe(16)
+        self.stopping = threading.Event()
+        self._servers = []
+
+    def _listen(self, port: int) -> bool:
+        try:
+            httpd = _Server(("127.0.0.1", port), _Handler)
+        except OSError as e:
+            log.info("IPC port %s unavailable (%s).", port, e)
+            return False
+        httpd.token = self.token
+        httpd.actions = self.actions
+        httpd.stopping = self.stopping
+        self._servers.append(httpd)
+        self.port = httpd.server_address[1]
+        threading.Thread(target=httpd.serve_forever, name=f"ipc-{self.port}", daemon=True).start()
+        self._write_info()
+        log.info("🔌 Control API on http://127.0.0.1:%s", self.port)
+        return True
+
+    def _write_info(self):
+        try:
+            IPC_INFO_PATH.write_text(json.dumps({"host": "127.0.0.1", "port": self.port,
+                                                 "pid": os.getpid(), "token": self.token},
+                                                indent=2), encoding="utf-8")
+        except Exception as e:
+            log.info("Could not write %s: %s", IPC_INFO_PATH, e)
+
+    def start(self):
+        self.is_leader = self._listen(self.fixed_port)
+        if not self.is_leader:
+            # port taken (e.g. another session); fall back to any free port
+            self._listen(0)
+
+    def try_promote(self) -> bool:
+        """Take over the configured port once its owner has gone away."""
+        if not self.is_leader and self._listen(self.fixed_port):
+            self.is_leader = True
+        return self.is_leader
+
+    def stop(self):
+        self.stopping.set()
+        STATE.wake()    # end /events streams now rather than at their next keepalive
+        for httpd in self._servers:
+            try: httpd.shutdown(); httpd.server_close()
+            except Exception: pass
+        self._servers = []
+        self.is_leader = False
+        try: IPC_INFO_PATH.unlink()
+        except Exception: pass
@@ -1,11 +1,46 @@
 # net.py
-import re, subprocess, time, requests, urllib3, logging
+import re, ssl, time, socket, ipaddress, threading, requests, urllib3, logging
+from urllib3.util.wait import wait_for_read
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit, urlunsplit
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from state import STATE
+from profiling import span
+from supervisor import HEALTH, run_command, call_with_deadline
 log = logging.getLogger("mdi")
 
+# Connectivity probes: every endpoint must answer 204 when the network is open.
+# Overridden by "probe_urls" in config.json. Raw-IP URLs are allowed and skip DNS
+# entirely, e.g. "http://142.250.183.14/generate_204" (a Google frontend
+# address; check it still answers 204 before relying on it).
+DEFAULT_PROBE_URLS = [
+    "http://clients3.google.com/generate_204",
+    "http://connectivitycheck.gstatic.com/generate_204",
+    "http://www.gstatic.com/generate_204",
+]
+PROBE_TIMEOUT = 3
+PROBE_MAX_BYTES = 1024      # never read more than this from a probe response
+PROBE_MODES = ("get", "head", "socket")
+PORTAL_MARKERS = ("172.16.", "24online")
+DNS_TTL = 300
+
+_probe_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="probe")
+_dns_cache = {}             # host -> (ip, resolved_at)
+_dns_lock = threading.Lock()
+# keep-alive pool for the portal, so a pre-connected socket can be reused by send_login
+_login_session = requests.Session()
+# prewarm_login() reaches into the urllib3 2.x pool (_get_conn/_put_conn, is_connected)
+_CAN_PREWARM = int(urllib3.__version__.split(".")[0]) >= 2
+# own single thread so a slow portal can never tie up the probe pool
+_prewarm_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prewarm")
+_prewarm_future = None
+_prewarm_lock = threading.Lock()
+TLS_DRAIN_QUIET_S = 0.3
+
 def any_connected_ssid(ssid: str) -> bool:
     try:
-        out = subprocess.check_output("netsh wlan show interfaces", shell=True).decode(errors="ignore")
+        with span("subprocess.netsh"):
+            out = run_command(["netsh", "wlan", "show", "interfaces"]).decode(errors="ignore")
         blocks = re.split(r"\r?\n\s*Name\s*:", out)
         for b in blocks:
             if not b.strip(): continue
@@ -19,46 +54,252 @@ def any_connected_ssid(ssid: str) -> bool:
 
 def gateway_is_campus() -> bool:
     try:
-        out = subprocess.check_output("ipconfig", shell=True).decode(errors="ignore")
+        with span("subprocess.ipconfig"):
+            out = run_command(["ipconfig"]).decode(errors="ignore")
         for gw in re.findall(r"Default Gateway[^\r\n]*:\s*([\d\.]+)", out, re.I):
             if gw.startswith("172.16."): return True
     except Exception:
         pass
     return False
 
-def portal_intercept_present() -> bool:
+# ---------- DNS cache ----------
+def _is_ip(host: str) -> bool:
     try:
-        r = requests.get("http://clients3.google.com/generate_204",
-                         timeout=3, verify=False, allow_redirects=True)
-        return ("172.16." in r.url) or ("24online" in r.text.lower())
-    except Exception:
+        ipaddress.ip_address(host); return True
+    except ValueError:
         return False
 
-def connected_to_target(cfg) -> bool:
-    return any_connected_ssid(cfg["ssid"]) or gateway_is_campus() or portal_intercept_present()
+def cached_ip(host: str):
+    """Last known address for host. Stale entries are still returned: while the
+    portal is up the resolver may be slow or hijacked, an old answer is better.
+    Entries are dropped when the address stops answering (see _probe_request)."""
+    with _dns_lock:
+        hit = _dns_cache.get(host)
+    return hit[0] if hit else None
+
+def forget_ip(host: str):
+    with _dns_lock:
+        _dns_cache.pop(host, None)
+
+def prewarm_dns(urls):
+    """Resolve probe hosts whose cache entry is missing or older than DNS_TTL."""
+    now = time.time()
+    for url in urls:
+        host = urlsplit(url).hostname
+        if not host or _is_ip(host):
+            continue
+        with _dns_lock:
+            hit = _dns_cache.get(host)
+        if hit and now - hit[1] < DNS_TTL:
+            continue
+        try:
+            ip = socket.getaddrinfo(host, 80, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            continue
+        with _dns_lock:
+            _dns_cache[host] = (ip, now)
+
+def _probe_target(url: str):
+    """Rewrite plain-http probe URLs to a cached address, keeping the Host header."""
+    parts = urlsplit(url)
+    host = parts.hostname
+    if parts.scheme != "http" or not host or _is_ip(host):
+        return url, {}
+    ip = cached_ip(host)
+    if not ip:
+        return url, {}
+    netloc = ip if parts.port is None else f"{ip}:{parts.port}"
+    return urlunsplit(parts._replace(netloc=netloc)), {"Host": parts.netloc}
 
-def online_now() -> bool:
+# ---------- probes ----------
+def probe_urls(cfg=None):
+    return (cfg or {}).get("probe_urls") or DEFAULT_PROBE_URLS
+
+def probe_mode(cfg=None) -> str:
+    mode = (cfg or {}).get("probe_mode", "get")
+    return mode if mode in PROBE_MODES else "get"
+
+def _classify(status: int, location: str, body):
+    """Map a probe response to 'online', 'captive' or None (inconclusive).
+    Only a 204 means online, and only a portal marker (in Location or the body)
+    means captive: an unmarked interstitial may be some other network's (hotel,
+    proxy), and connected_to_target() must not take it for campus. body is None
+    when it wasn't read (HEAD)."""
+    if status == 204:
+        return "online"
+    if 300 <= status < 400:
+        loc = (location or "").lower()
+        return "captive" if any(m in loc for m in PORTAL_MARKERS) else None
+    if body is None:
+        return None
+    text = body.decode("latin-1").lower()
+    return "captive" if any(m in text for m in PORTAL_MARKERS) else None
+
+def _raw_http_probe(target: str, headers: dict):
+    """HTTP/1.0 GET over a bare socket; reads at most PROBE_MAX_BYTES in total."""
+    parts = urlsplit(target)
+    path = parts.path or "/"
+    if parts.query: path += "?" + parts.query
+    host = headers.get("Host") or parts.netloc
+    req = f"GET {path} HTTP/1.0\r\nHost: {host}\r\nConnection: close\r\n\r\n"
+    buf = b""
+    with socket.create_connection((parts.hostname, parts.port or 80), timeout=PROBE_TIMEOUT) as sock:
+        sock.sendall(req.encode("ascii"))
+        while len(buf) < PROBE_MAX_BYTES:
+            chunk = sock.recv(PROBE_MAX_BYTES - len(buf))
+            if not chunk: break
+            buf += chunk
+    head, _, body = buf.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    location = next((l.split(":", 1)[1].strip() for l in lines[1:] if l.lower().startswith("location:")), "")
+    return status, location, body
+
+def _probe_one(url: str, mode: str = "get"):
+    """'online', 'captive', or None when the endpoint gave no usable answer.
+    Redirects are never followed and at most PROBE_MAX_BYTES are read, so an
+    intercepted probe costs one round trip instead of a portal page load."""
+    STATE.incr("probes")
+    with span(f"probe.{mode}"):
+        return _probe_request(url, mode)
+
+def _probe_request(url: str, mode: str):
+    target, headers = _probe_target(url)
     try:
-        r = requests.get("http://clients3.google.com/generate_204",
-                         timeout=3, verify=False, allow_redirects=True)
-        return not(("172.16." in r.url) or ("24online" in r.text.lower()))
+        return _probe_send(target, headers, mode)
+    except (requests.Timeout, socket.timeout):
+        # no time left for a second try; the next probe goes through DNS
+        if headers: forget_ip(urlsplit(url).hostname)
+        return None
+    except OSError:
+        if not headers:
+            return None
+        # the cached address refused or is unreachable: drop it and resolve afresh
+        forget_ip(urlsplit(url).hostname)
+        try:
+            return _probe_send(url, {}, mode)
+        except Exception:
+            return None
     except Exception:
+        return None
+
+def _probe_send(target: str, headers: dict, mode: str):
+    if mode == "socket" and target.startswith("http://"):
+        return _classify(*_raw_http_probe(target, headers))
+    if mode == "head":
+        r = requests.head(target, headers=headers,
+                          timeout=PROBE_TIMEOUT, verify=False, allow_redirects=False)
+        return _classify(r.status_code, r.headers.get("Location", ""), None)
+    with requests.get(target, headers=headers, stream=True,
+                      timeout=PROBE_TIMEOUT, verify=False, allow_redirects=False) as r:
+        body = b""
+        if r.status_code != 204 and not r.is_redirect:
+            for chunk in r.iter_content(512):
+                body += chunk
+                if len(body) >= PROBE_MAX_BYTES: break
+        return _classify(r.status_code, r.headers.get("Location", ""), body[:PROBE_MAX_BYTES])
+
+def probe_state(cfg=None):
+    """Race all probe endpoints in parallel; the first conclusive answer wins."""
+    mode = probe_mode(cfg)
+    futures = [_probe_pool.submit(_probe_one, u, mode) for u in probe_urls(cfg)]
+    try:
+        for f in as_completed(futures, timeout=PROBE_TIMEOUT + 1):
+            res = f.result()
+            if res is not None:
+                return res
+    except FutureTimeout:
+        HEALTH.degraded("all connectivity probes hung")
+    return None
+
+def portal_intercept_present(cfg=None) -> bool:
+    return probe_state(cfg) == "captive"
+
+def connected_to_target(cfg) -> bool:
+    return any_connected_ssid(cfg["ssid"]) or gateway_is_campus() or portal_intercept_present(cfg)
+
+def online_now(cfg=None) -> bool:
+    if probe_state(cfg) != "online":
         return False
+    # only resolve while the real resolver is reachable
+    _probe_pool.submit(prewarm_dns, probe_urls(cfg))
+    return True
+
+def _drain_tls(conn, quiet_s: float = TLS_DRAIN_QUIET_S, max_records: int = 8):
+    """Consume TLS 1.3 session tickets sent after the handshake (servers usually send
+    two, not always back to back) until the socket stays quiet for quiet_s. Left
+    unread they make the idle socket look readable and urllib3 discards it as dropped."""
+    sock = conn.sock
+    if sock is None:
+        return
+    prev = sock.gettimeout()
+    sock.settimeout(0)
+    try:
+        for _ in range(max_records):
+            if not wait_for_read(sock, timeout=quiet_s):
+                return
+            try:
+                sock.recv(1)
+            except ssl.SSLWantReadError:
+                continue    # a ticket (or other post-handshake record); keep going
+            break           # real data or EOF on an idle connection
+        conn.close()        # chatty or closing: don't pool it
+    finally:
+        if conn.sock is not None: sock.settimeout(prev)
+
+def prewarm_login(cfg):
+    """Resolve the portal host and complete the TCP + TLS handshake into the login
+    session's pool, so the next send_login() goes out on an open connection.
+    Does nothing if the pool already holds a live connection."""
+    if not _CAN_PREWARM:
+        return
+    url = cfg["login_url"]
+    try:
+        with span("login.prewarm"):
+            adapter = _login_session.get_adapter(url)
+            if hasattr(adapter, "get_connection_with_tls_context"):   # requests >= 2.32
+                pool = adapter.get_connection_with_tls_context(
+                    requests.Request("POST", url).prepare(), verify=False)
+            else:
+                pool = adapter.get_connection(url)
+                adapter.cert_verify(pool, url, False, None)
+            conn = pool._get_conn()
+            try:
+                if not conn.is_connected:
+                    # the adapter's pool has no timeout of its own
+                    conn.timeout = cfg.get("post_timeout", PROBE_TIMEOUT)
+                    conn.connect()
+                    _drain_tls(conn)
+            finally:
+                pool._put_conn(conn)
+    except Exception as e:
+        log.debug("Portal pre-connect failed: %s", e)
+
+def prewarm_login_async(cfg):
+    """At most one prewarm runs or waits at a time; extra calls share it."""
+    global _prewarm_future
+    with _prewarm_lock:
+        if _prewarm_future is None or _prewarm_future.done():
+            _prewarm_future = _prewarm_pool.submit(prewarm_login, cfg)
+        return _prewarm_future
 
 def send_login(cfg, username: str, password: str) -> bool:
     payload = {"mode":"191","username":username,"password":password}
     try:
-        r = requests.post(cfg["login_url"], data=payload,
-                          timeout=cfg["post_timeout"], verify=False, allow_redirects=True)
+        with span("login.post"):
+            # requests' timeout is per socket operation; also cap the whole call
+            r = call_with_deadline(_login_session.post, cfg["post_timeout"] + 5, "login POST",
+                                   cfg["login_url"], data=payload,
+                                   timeout=cfg["post_timeout"], verify=False, allow_redirects=True)
         log.info("📨 Login POST sent (status %s).", r.status_code)
         return True
     except Exception as e:
         log.info("❌ Error sending login POST: %s", e)
         return False
 
-def settle_until_online(max_s: float, step: float) -> bool:
+def settle_until_online(max_s: float, step: float, cfg=None) -> bool:
     waited = 0.0
     while waited < max_s:
-        if online_now(): return True
+        if online_now(cfg): return True
         time.sleep(step); waited += step
     return False
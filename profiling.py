@@ -0,0 +1,164 @@
+# profiling.py
+"""
+MDI AutoLogin - built-in profiling hooks
+
+Off by default. When switched on (tray menu, `--profile`, "profiling": true
+in config.json or the control API) it runs:
+  * a stack sampler over every thread (Tk main thread, tray, worker, probes),
+  * tracemalloc, compared against a baseline snapshot taken at start,
+  * timing spans around probes, subprocess calls, login POSTs and Tk callbacks.
+
+dump() writes everything to app_dir()/profiles/<timestamp>/:
+  stacks.txt      collapsed stacks ("thread;frame;frame count"), flamegraph.pl format
+  spans.json      count / total / max seconds per span
+  tracemalloc.txt top allocations and growth since start
+"""
+
+import sys, os, time, json, threading, tracemalloc, functools, logging
+from collections import Counter
+from contextlib import contextmanager
+
+from config import app_dir
+
+log = logging.getLogger("mdi.prof")
+
+PROFILE_DIR = app_dir() / "profiles"
+SAMPLE_INTERVAL = 0.01
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCS = 40
+
+def _frame_label(frame) -> str:
+    co = frame.f_code
+    return f"{co.co_name}@{os.path.basename(co.co_filename)}:{co.co_firstlineno}"
+
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()       # collected data
+        self._control = threading.Lock()    # start / stop
+        self.enabled = False
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self._samples = Counter()   # collapsed stack -> hits
+        self._spans = {}            # name -> [count, total_s, max_s]
+        self._baseline = None
+        self._own_tracemalloc = False   # did start() turn tracemalloc on?
+
+    # ---------- control ----------
+    def start(self, interval: float = SAMPLE_INTERVAL):
+        with self._control:
+            if self.enabled:
+                return
+            with self._lock:
+                self._samples.clear(); self._spans.clear()
+            self._started = time.time()
+            self._own_tracemalloc = not tracemalloc.is_tracing()
+            if self._own_tracemalloc:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._baseline = tracemalloc.take_snapshot()
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, args=(interval,),
+                                             name="profiler", daemon=True)
+            self.enabled = True
+            self._sampler.start()
+        log.info("🩺 Profiling started.")
+
+    def stop(self):
+        """Stop sampling and write a final dump; returns the dump directory (or None)."""
+        # serialised so concurrent stops (tray, API, quit) dump once
+        with self._control:
+            if not self.enabled:
+                return None
+            self.enabled = False
+            self._stop.set()
+            out = self._write_dump()
+            self._baseline = None
+            if self._own_tracemalloc:
+                tracemalloc.stop()
+                self._own_tracemalloc = False
+        log.info("🩺 Profiling stopped.")
+        return out
+
+    def toggle(self):
+        return self.stop() if self.enabled else self.start()
+
+    # ---------- collection ----------
+    def _sample_loop(self, interval: float):
+        me = threading.get_ident()
+        while not self._stop.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    self._samples[key] += 1
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            s = self._spans.setdefault(name, [0, 0.0, 0.0])
+            s[0] += 1; s[1] += seconds; s[2] = max(s[2], seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def timed(self, name: str):
+        """Decorator form of span()."""
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*a, **kw):
+                if not self.enabled:
+                    return fn(*a, **kw)
+                with self.span(name):
+                    return fn(*a, **kw)
+            return wrapper
+        return deco
+
+    # ---------- output ----------
+    def dump(self):
+        if not self.enabled:
+            return None
+        return self._write_dump()
+
+    def _write_dump(self):
+        out = PROFILE_DIR / time.strftime("%Y%m%d-%H%M%S")
+        out.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            samples = list(self._samples.items())
+            spans = {k: {"count": c, "total_s": round(t, 6), "max_s": round(m, 6),
+                         "avg_s": round(t / c, 6) if c else 0.0}
+                     for k, (c, t, m) in self._spans.items()}
+            baseline = self._baseline
+        (out / "stacks.txt").write_text(
+            "".join(f"{k} {n}\n" for k, n in sorted(samples)), encoding="utf-8")
+        (out / "spans.json").write_text(json.dumps(
+            {"started": self._started, "duration_s": round(time.time() - self._started, 3),
+             "spans": spans}, indent=2), encoding="utf-8")
+        if tracemalloc.is_tracing():
+            snap = tracemalloc.take_snapshot()
+            cur, peak = tracemalloc.get_traced_memory()
+            lines = [f"current={cur} peak={peak}", "", "# top allocations"]
+            lines += [str(s) for s in snap.statistics("lineno")[:TOP_ALLOCS]]
+            if baseline is not None:
+                lines += ["", "# growth since profiling started"]
+                lines += [str(s) for s in snap.compare_to(baseline, "lineno")[:TOP_ALLOCS]]
+            (out / "tracemalloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        log.info("🩺 Profile written to %s", out)
+        return out
+
+PROFILER = Profiler()
+span = PROFILER.span
+timed = PROFILER.timed
@@ -0,0 +1,77 @@
+# state.py
+"""
+Shared, thread-safe status snapshot for the running instance.
+
+The worker, the tray/panel and the local control API all read and write the
+same AppState, so status can be served from cache instead of re-probing.
+"""
+import threading, time
+
+class AppState:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+        self._status = {
+            "worker": "stopped",       # stopped | running
+            "role": "standalone",      # standalone | leader | follower (see instance.py)
+            "leader_worker": None,     # follower only: the leader's worker state
+            "network": "unknown",      # unknown | online | captive | offline
+            "health": "ok",            # ok | degraded (see supervisor.py)
+            "health_reason": "",
+            "ssid": "",
+            "last_check": None,
+            "last_login": None,
+            "last_login_ok": None,
+        }
+        self._metrics = {
+            "started": time.time(),
+            "cycles": 0,
+            "probes": 0,
+            "logins_sent": 0,
+            "login_failures": 0,
+            "online_confirmed": 0,
+            "loop_errors": 0,
+            "timeouts": 0,
+            "watchdog_restarts": 0,
+        }
+
+    def update(self, **fields):
+        """Merge fields into the status; wakes subscribers only if something changed."""
+        with self._cond:
+            changed = {k: v for k, v in fields.items() if self._status.get(k) != v}
+            if not changed:
+                return
+            self._status.update(changed)
+            self._version += 1
+            self._cond.notify_all()
+
+    def incr(self, name: str, n: int = 1):
+        with self._cond:
+            self._metrics[name] = self._metrics.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self._status, version=self._version, time=time.time())
+
+    def metrics(self) -> dict:
+        with self._cond:
+            m = dict(self._metrics)
+        m["uptime"] = round(time.time() - m["started"], 1)
+        return m
+
+    def wait_change(self, version: int, timeout: float, cancel: threading.Event = None):
+        """Block until the status version moves past `version`; returns a snapshot,
+        or None on timeout or once `cancel` is set (see wake())."""
+        cancelled = lambda: cancel is not None and cancel.is_set()
+        with self._cond:
+            self._cond.wait_for(lambda: self._version != version or cancelled(), timeout=timeout)
+            if self._version == version or cancelled():
+                return None
+            return dict(self._status, version=self._version, time=time.time())
+
+    def wake(self):
+        """Wake every wait_change() caller so it can re-check its cancel event."""
+        with self._cond:
+            self._cond.notify_all()
+
+STATE = AppState()
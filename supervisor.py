@@ -0,0 +1,129 @@
+# supervisor.py
+"""
+MDI AutoLogin - supervised execution of external calls
+
+Every subprocess and network call the worker makes goes through here so that
+a hung netsh / ipconfig / portal can't freeze the worker loop:
+  * run_command()  - subprocess with a hard timeout; the whole process tree is
+                     killed when it expires,
+  * call_with_deadline() - runs a call on a helper thread and gives up on it
+                     after a deadline,
+  * HEALTH         - timeouts and watchdog restarts flip the shared status to
+                     "degraded" until things have been quiet for a while,
+  * Watchdog       - notices a worker loop that stopped making progress.
+"""
+
+import os, sys, time, signal, subprocess, threading, logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from state import STATE
+
+log = logging.getLogger("mdi.supervisor")
+
+CMD_TIMEOUT = 10
+DEGRADED_HOLD_S = 60
+
+_call_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="supervised")
+
+class Health:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_problem = None
+
+    def degraded(self, reason: str, metric: str = "timeouts"):
+        with self._lock:
+            self._last_problem = time.monotonic()
+        STATE.incr(metric)
+        STATE.update(health="degraded", health_reason=reason)
+        log.info("🩹 Degraded: %s", reason)
+
+    def check_recovered(self):
+        """Back to 'ok' once nothing has gone wrong for DEGRADED_HOLD_S."""
+        with self._lock:
+            last = self._last_problem
+            if last is None or time.monotonic() - last < DEGRADED_HOLD_S:
+                return
+            self._last_problem = None
+        STATE.update(health="ok", health_reason="")
+        log.info("🩹 Health back to normal.")
+
+HEALTH = Health()
+
+def _kill_tree(proc: subprocess.Popen):
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5,
+                           creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        pass
+    try: proc.kill()
+    except Exception: pass
+
+def run_command(args, timeout: float = CMD_TIMEOUT) -> bytes:
+    """check_output() with a hard timeout. The child runs in its own process
+    group and the whole tree is killed on expiry (raises TimeoutExpired)."""
+    kw = {"stdout": subprocess.PIPE, "stderr": subprocess.DEVNULL, "stdin": subprocess.DEVNULL}
+    if sys.platform == "win32":
+        kw["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | getattr(subprocess, "CREATE_NO_WINDOW", 0)
+    else:
+        kw["start_new_session"] = True
+    proc = subprocess.Popen(args, **kw)
+    try:
+        out, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_tree(proc)
+        try: proc.communicate(timeout=2)
+        except Exception: pass
+        HEALTH.degraded(f"{args[0]} hung for {timeout}s")
+        raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args, out)
+    return out
+
+def call_with_deadline(fn, deadline: float, name: str, *args, **kwargs):
+    """Run fn on a helper thread; raises TimeoutError if it hasn't returned after
+    `deadline` seconds. The stuck call is abandoned, not interrupted."""
+    fut = _call_pool.submit(fn, *args, **kwargs)
+    try:
+        return fut.result(timeout=deadline)
+    except FutureTimeout:
+        # if it never got a thread (pool busy with abandoned calls), make sure it
+        # doesn't run later behind the caller's back, e.g. a second login POST
+        fut.cancel()
+        HEALTH.degraded(f"{name} exceeded {deadline}s")
+        raise TimeoutError(f"{name} exceeded {deadline}s") from None
+
+class Watchdog:
+    """Every `interval` seconds calls `heartbeat()` (a time.monotonic() stamp of
+    the last progress, possibly in the future while the loop sleeps on purpose;
+    None when there is nothing to watch) and `on_stall()` once it is older than
+    stall_s. Also drives HEALTH recovery and calls the optional `on_tick()`."""
+
+    def __init__(self, heartbeat, on_stall, stall_s: float, interval: float = 5.0, on_tick=None):
+        self.heartbeat = heartbeat
+        self.on_stall = on_stall
+        self.stall_s = stall_s
+        self.interval = interval
+        self.on_tick = on_tick
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="watchdog", daemon=True).start()
+
+    def stop(self): self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                hb = self.heartbeat()
+                if hb is not None and time.monotonic() - hb > self.stall_s:
+                    HEALTH.degraded(f"worker loop stalled for over {self.stall_s:.0f}s",
+                                    metric="watchdog_restarts")
+                    self.on_stall()
+                HEALTH.check_recovered()
+                if self.on_tick: self.on_tick()
+            except Exception:
+                log.exception("Watchdog check failed")
@@ -19,8 +19,13 @@ import shutil
 from config import (APP_NAME, DEFAULT_SSID, LOG_PATH,
                     load_config, save_config, get_password, set_password,
                     is_autostart_enabled, set_autostart)
-from net import (connected_to_target, online_now, portal_intercept_present,
-                 send_login, settle_until_online)
+from net import connected_to_target, probe_state
+from state import STATE
+from ipc import ControlServer, DEFAULT_IPC_PORT
+from profiling import PROFILER, span, timed
+from engine import LOGIN_FLIGHT, LiveEnv, TraceRecorder, attempt_login, run_cycle
+from supervisor import Watchdog
+from instance import LeaderFollower
 
 log = logging.getLogger("mdi.ui")
 
@@ -105,44 +110,46 @@ def apply_theme(root, dark: bool):
     style.configure("TCheckbutton", background=bg, foreground=fg)
     root.configure(bg=bg)
 
-# ---------- Worker (unchanged) ----------
+# ---------- Worker ----------
 class AutoLoginWorker(threading.Thread):
     def __init__(self, tray_ref):
-        super().__init__(daemon=True)
+        super().__init__(daemon=True, name="AutoLoginWorker")
         self.tray_ref = tray_ref
         self.stop_event = threading.Event()
         self.running = False
+        # watched by TrayApp's watchdog; pushed past planned sleeps so a long
+        # base_interval / retry_wait isn't mistaken for a stall
+        self.heartbeat = time.monotonic()
 
     def run(self):
         cfg = load_config()
         username = cfg.get("username", "")
         password = get_password(username)
+        recorder = TraceRecorder() if cfg.get("record_trace", False) else None
+        env = LiveEnv(cfg, self.stop_event, recorder)
+        env.on_sleep = self._beat_after
         self.tray_ref.update_tooltip(True)
         self.running = True
+        STATE.update(worker="running", ssid=cfg["ssid"])
         while not self.stop_event.is_set():
+            self.heartbeat = time.monotonic()
+            sleep_t = max(1.0, cfg["base_interval"] + random.uniform(-1, 1))
             try:
-                if connected_to_target(cfg):
-                    if not online_now():
-                        log.info("🔒 Logged out. Attempting login…")
-                        ok = send_login(cfg, username, password)
-                        if ok and settle_until_online(cfg["settle_max"], cfg["settle_step"]):
-                            log.info("✅ Online confirmed.")
-                        else:
-                            log.info("⏳ Portal still intercepting; will retry.")
-                            time.sleep(cfg["retry_wait"])
-                    else:
-                        log.info("✅ Already online.")
-                else:
-                    log.info("📶 Not on %s (or still acquiring).", cfg["ssid"])
+                with span("worker.cycle"):
+                    sleep_t = run_cycle(env, cfg, username, password)
             except Exception as e:
+                STATE.incr("loop_errors")
                 log.info("⚠️ Worker loop error: %s", e)
-            sleep_t = max(1.0, cfg["base_interval"] + random.uniform(-1, 1))
             # interruptible sleep
-            end = time.time() + sleep_t
-            while time.time() < end and not self.stop_event.is_set():
-                time.sleep(0.2)
+            env.sleep(sleep_t)
         self.running = False
-        self.tray_ref.update_tooltip(False)
+        # an abandoned (watchdog-replaced) worker must not clobber its replacement's status
+        if self.tray_ref.worker in (None, self):
+            STATE.update(worker="stopped")
+            self.tray_ref.update_tooltip(False)
+
+    def _beat_after(self, seconds: float):
+        self.heartbeat = time.monotonic() + seconds
 
     def stop(self): self.stop_event.set()
 
@@ -174,6 +181,7 @@ class SettingsWindow:
         self.ent_pwd.insert(0, get_password(cfg.get("username","")))
         self.ent_pwd.pack(side="left", fill="x", expand=True)
         self._pw_visible = False
+        @timed("tk.settings.toggle_pw")
         def toggle_pw():
             self._pw_visible = not self._pw_visible
             self.ent_pwd.configure(show="" if self._pw_visible else "•")
@@ -205,6 +213,7 @@ class SettingsWindow:
         frm.columnconfigure(1, weight=1)
 
 
+    @timed("tk.settings.toggle_theme")
     def _toggle_theme(self):
         cfg = load_config()
         cfg["dark_mode"] = not cfg.get("dark_mode", False)
@@ -212,10 +221,12 @@ class SettingsWindow:
         apply_theme(self.root, cfg["dark_mode"])
         self.btn_theme.config(text=("Light mode" if cfg["dark_mode"] else "Dark mode"))
 
+    @timed("tk.settings.cancel")
     def on_cancel(self):
         try: self.root.destroy()
         except Exception: pass
 
+    @timed("tk.settings.save")
     def on_save(self):
         ssid = self.ent_ssid.get().strip() or DEFAULT_SSID
         user = self.ent_user.get().strip()
@@ -290,9 +301,9 @@ class ControlPanel:
         # small reset buttons group
         resets = ttk.Frame(row)
         resets.pack(side="right")
-        ttk.Button(resets, text="Reset log", command=self.tray_app.reset_log_file).pack(side="left", padx=(0,6))
-        ttk.Button(resets, text="Reset settings", command=self.tray_app.reset_settings).pack(side="left", padx=(0,6))
-        ttk.Button(resets, text="Reset app", command=self.tray_app.reset_app).pack(side="left")
+        ttk.Button(resets, text="Reset log", command=timed("tk.panel.reset_log")(self.tray_app.reset_log_file)).pack(side="left", padx=(0,6))
+        ttk.Button(resets, text="Reset settings", command=timed("tk.panel.reset_settings")(self.tray_app.reset_settings)).pack(side="left", padx=(0,6))
+        ttk.Button(resets, text="Reset app", command=timed("tk.panel.reset_app")(self.tray_app.reset_app)).pack(side="left")
 
 
         # Log viewer
@@ -317,7 +328,11 @@ class ControlPanel:
     # helper strings
     def _status_text(self):
         running = self.tray_app.worker is not None and self.tray_app.worker.running
-        return f"SSID: {self.cfg.get('ssid', DEFAULT_SSID)}   |   Username: {self.cfg.get('username','') or '(not set)'}   |   Auto-login: {'Running' if running else 'Stopped'}"
+        snap = STATE.snapshot()
+        if self.tray_app.role == "follower":
+            running = snap["leader_worker"] == "running"
+        health = f"   |   Degraded: {snap['health_reason']}" if snap["health"] == "degraded" else ""
+        return f"SSID: {self.cfg.get('ssid', DEFAULT_SSID)}   |   Username: {self.cfg.get('username','') or '(not set)'}   |   Auto-login: {'Running' if running else 'Stopped'}{health}"
     def _toggle_text(self):
         running = self.tray_app.worker is not None and self.tray_app.worker.running
         return "Stop auto-login" if running else "Start auto-login"
@@ -344,6 +359,7 @@ class ControlPanel:
 
 
     # actions
+    @timed("tk.panel.toggle_autologin")
     def _toggle_autologin(self):
         if self.tray_app.worker and self.tray_app.worker.running:
             self.tray_app.stop_worker()
@@ -351,26 +367,29 @@ class ControlPanel:
             self.tray_app.start_worker()
         self._refresh_status()
 
+    @timed("tk.panel.manual_login")
     def _manual_login(self):
-        cfg = load_config()
-        user = cfg.get("username", ""); pwd = get_password(user)
-        if not user or not pwd:
+        result = self.tray_app.login_now()
+        if result == "follower":
+            msg_info(APP_NAME, "Auto-login is handled by the instance in another session.")
+            return
+        if result == "no_credentials":
             msg_info(APP_NAME, "Set username/password in Settings first.")
             return
-        if not connected_to_target(cfg):
+        if result == "not_connected":
             self._set_status_color("#FFA000")
-            msg_info(APP_NAME, f"Not on {cfg['ssid']} yet.")
+            msg_info(APP_NAME, f"Not on {load_config()['ssid']} yet.")
             return
-        ok = send_login(cfg, user, pwd)
-        if ok:
-            settled = settle_until_online(cfg["settle_max"], cfg["settle_step"])
-            self._set_status_color("#28a745" if settled else "#FFA000")
-            msg_info(APP_NAME, "Login sent." + (" Online." if settled else " Waiting for portal…"))
-        else:
+        if result == "failed":
             self._set_status_color("#E53935")
             msg_error(APP_NAME, "Could not send login request.")
+        else:
+            settled = result == "online"
+            self._set_status_color("#28a745" if settled else "#FFA000")
+            msg_info(APP_NAME, "Login sent." + (" Online." if settled else " Waiting for portal…"))
         self._refresh_log()
 
+    @timed("tk.panel.open_settings")
     def _open_settings(self):
         SettingsWindow(self.root, first_run=False)
         # settings window is a Toplevel; after it closes, reload config
@@ -385,17 +404,20 @@ class ControlPanel:
             self.txt.configure(bg="white", fg="#111111", insertbackground="black")
             self.status_label.configure(bg=ui_bg(self.root), fg="#000000")
 
+    @timed("tk.panel.toggle_startup")
     def _toggle_startup(self):
         exe = sys.executable if getattr(sys, "frozen", False) else os.path.abspath(sys.argv[0])
         set_autostart(not is_autostart_enabled(), exe)
         self._refresh_status()
 
+    @timed("tk.panel.open_log")
     def _open_log(self):
         try:
             webbrowser.open(LOG_PATH.as_uri())
         except Exception:
             os.startfile(str(LOG_PATH))
 
+    @timed("tk.panel.toggle_theme")
     def _toggle_theme(self):
         self.cfg["dark_mode"] = not self.cfg.get("dark_mode", False)
         save_config(self.cfg)
@@ -410,6 +432,7 @@ class ControlPanel:
             self.status_label.configure(bg=ui_bg(self.root), fg="#000000")
         self.btn_theme.config(text=self._theme_text())
 
+    @timed("tk.panel.quit")
     def _quit_app(self):
         self.tray_app.stop_worker()
         self._cancel_log_refresh()
@@ -418,10 +441,21 @@ class ControlPanel:
         try: self.tray_app.icon.stop()
         except Exception: pass
 
+    @timed("tk.panel.refresh_status")
     def _refresh_status(self):
-        # build state text
-        online = online_now()
-        captive = portal_intercept_present() or connected_to_target(self.cfg)
+        # build state text; prefer the worker's cached result over probing from the Tk thread
+        snap = STATE.snapshot()
+        running = self.tray_app.worker is not None and self.tray_app.worker.running
+        following = self.tray_app.role == "follower"
+        if (running or following) and snap["last_check"] and time.time() - snap["last_check"] < 30:
+            online = snap["network"] == "online"
+            captive = snap["network"] == "captive"
+        else:
+            probed = probe_state(self.cfg)
+            online = probed == "online"
+            captive = probed == "captive" or (not online and connected_to_target(self.cfg))
+            STATE.update(network="online" if online else "captive" if captive else "offline",
+                         last_check=time.time())
         if online:
             color = "#28a745"
             status_extra = "Online"
@@ -443,6 +477,7 @@ class ControlPanel:
             pass
 
 
+    @timed("tk.panel.refresh_log")
     def _refresh_log(self):
         try:
             txt = LOG_PATH.read_text(encoding="utf-8", errors="ignore")
@@ -457,6 +492,7 @@ class ControlPanel:
     def _schedule_log_refresh(self):
         self._log_timer = self.root.after(2000, self._on_log_tick)
 
+    @timed("tk.panel.log_tick")
     def _on_log_tick(self):
         try:
             self._refresh_log()
@@ -472,6 +508,7 @@ class ControlPanel:
         except Exception:
             pass
 
+    @timed("tk.panel.close")
     def _on_close(self):
         self._cancel_log_refresh()
         try: self.root.destroy()
@@ -485,6 +522,10 @@ class TrayApp:
         self.panel = None
         self.icon = pystray.Icon("mdi_tray")
         self.worker = None
+        self.ipc = None
+        self.watchdog = None
+        self.role = "standalone"
+        self.follower = None
         self.icon.icon = self._build_icon()
         self.icon.title = APP_NAME
         self.update_tooltip(False)
@@ -497,6 +538,8 @@ class TrayApp:
             pystray.MenuItem("Manual login now", self.manual_login),
             pystray.MenuItem("Settings…", self.open_settings),
             pystray.MenuItem("Open log", self.open_log),
+            pystray.MenuItem(lambda _: "Stop profiling && dump" if PROFILER.enabled else "Start profiling",
+                             self.toggle_profiling),
             pystray.MenuItem("Reset log", lambda _: self.reset_log_file()),
             pystray.MenuItem("Reset settings", lambda _: self.reset_settings()),
             pystray.MenuItem("Reset app", lambda _: self.reset_app()),
@@ -514,10 +557,12 @@ class TrayApp:
         return img
 
     def update_tooltip(self, running: bool):
-        self.icon.title = f"{APP_NAME} — {'Running' if running else 'Idle'}"
+        degraded = STATE.snapshot()["health"] == "degraded"
+        self.icon.title = f"{APP_NAME} — {'Running' if running else 'Idle'}{' (degraded)' if degraded else ''}"
 
     # All UI actions scheduled on tk_root to run in GUI thread
     def open_control_panel(self, _=None):
+        @timed("tk.show_panel")
         def _show_panel():
             # if open, bring to front
             if getattr(self, "panel", None) and self.panel.root.winfo_exists():
@@ -532,13 +577,43 @@ class TrayApp:
             self.panel = ControlPanel(self.tk_root, self)
         self.tk_root.after(0, _show_panel)
 
-    def start_worker(self, _=None):
+    def start_worker(self, _=None) -> str:
+        """Returns 'started', 'running' (already was) or 'follower' (refused)."""
         if self.worker and self.worker.running:
-            return
+            return "running"
+        if self.role == "follower":
+            log.info("👥 Auto-login is handled by the instance in another session.")
+            return "follower"
         self.worker = AutoLoginWorker(self)
         self.worker.start()
         log.info("▶️ Auto-login started.")
         self.update_tooltip(True)
+        return "started"
+
+    def _worker_heartbeat(self):
+        w = self.worker
+        if w is None or not w.running or w.stop_event.is_set():
+            return None
+        return w.heartbeat
+
+    def _on_worker_stall(self):
+        # the stuck thread can't be killed; stop it so it exits if it ever wakes up, and replace it
+        log.info("🐕 Worker loop stalled; restarting auto-login.")
+        old, self.worker = self.worker, None
+        if old:
+            old.stop()
+            # if it hung mid-login, don't let the replacement (or manual logins) queue behind it
+            if LOGIN_FLIGHT.abandon(old.ident):
+                log.info("🐕 Dropped the stalled worker's login attempt.")
+        self.start_worker()
+
+    def start_watchdog(self):
+        cfg = load_config()
+        self.watchdog = Watchdog(self._worker_heartbeat, self._on_worker_stall,
+                                 stall_s=float(cfg.get("watchdog_stall_s", 180)),
+                                 # keeps the "(degraded)" tooltip suffix current
+                                 on_tick=lambda: self.update_tooltip(self.worker is not None and self.worker.running))
+        self.watchdog.start()
 
     def stop_worker(self, _=None):
         if self.worker:
@@ -547,24 +622,54 @@ class TrayApp:
         log.info("⏹️ Auto-login stopped.")
         self.update_tooltip(False)
 
-    def manual_login(self, _=None):
+    def login_now(self) -> str:
+        """One manual login attempt without any dialogs.
+        Returns 'follower', 'no_credentials', 'not_connected', 'failed', 'pending' or 'online'."""
+        if self.role == "follower":
+            # the leader's token is in the other session's ipc.json, so we can't forward it
+            log.info("👥 Login is handled by the instance in another session.")
+            return "follower"
         cfg = load_config()
         user = cfg.get("username",""); pwd = get_password(user)
         if not user or not pwd:
-            msg_info(APP_NAME, "Please set username/password in Settings first.")
-            return
+            return "no_credentials"
+        # record manual logins too, or replay would treat the outages they fix as natural
+        env = LiveEnv(cfg, recorder=TraceRecorder() if cfg.get("record_trace", False) else None)
+        if cfg.get("speculative_login", True):
+            env.prewarm()   # overlaps the portal handshake with the detection below
         if not connected_to_target(cfg):
-            msg_info(APP_NAME, f"Not on {cfg['ssid']} yet.")
-            return
-        ok = send_login(cfg, user, pwd)
-        if ok:
-            settled = settle_until_online(cfg["settle_max"], cfg["settle_step"])
-            msg_info(APP_NAME, "Login sent." + (" Online." if settled else " Waiting for portal…"))
-        else:
+            return "not_connected"
+        # joins the worker's attempt if one is already in flight
+        ok, settled = attempt_login(env, cfg, user, pwd)
+        if not ok:
+            return "failed"
+        return "online" if settled else "pending"
+
+    def manual_login(self, _=None):
+        # off the pystray thread so the menu stays responsive; repeated clicks share one attempt
+        threading.Thread(target=self._manual_login_dialog, name="manual-login", daemon=True).start()
+
+    def _manual_login_dialog(self):
+        result = self.login_now()
+        if result == "follower":
+            msg_info(APP_NAME, "Auto-login is handled by the instance in another session.")
+        elif result == "no_credentials":
+            msg_info(APP_NAME, "Please set username/password in Settings first.")
+        elif result == "not_connected":
+            msg_info(APP_NAME, f"Not on {load_config()['ssid']} yet.")
+        elif result == "failed":
             msg_error(APP_NAME, "Could not send login request.")
+        else:
+            msg_info(APP_NAME, "Login sent." + (" Online." if result == "online" else " Waiting for portal…"))
+
+    def toggle_profiling(self, _=None):
+        out = PROFILER.toggle()
+        if out:
+            msg_info(APP_NAME, f"Profile written to:\n{out}")
 
     def open_settings(self, _=None):
         # open settings as Toplevel on GUI thread
+        @timed("tk.open_settings")
         def _open():
             SettingsWindow(self.tk_root, first_run=False)
         self.tk_root.after(0, _open)
@@ -642,13 +747,21 @@ class TrayApp:
             msg_error(APP_NAME, f"Could not reset app: {e}")
 
     def quit(self, _=None):
-        # stop worker and icon
+        # stop worker, control API and icon
         self.stop_worker()
+        if self.ipc:
+            self.ipc.stop()
+        if self.watchdog:
+            self.watchdog.stop()
+        if self.follower:
+            self.follower.stop()
+        PROFILER.stop()
         try:
             self.icon.stop()
         except Exception:
             pass
         # schedule Tk root shutdown
+        @timed("tk.stop")
         def _stop_tk():
             try: self.tk_root.quit()
             except Exception: pass
@@ -656,13 +769,73 @@ class TrayApp:
     
     
 
+    def start_ipc(self):
+        """Serve the local control/status API (see ipc.py) if enabled in config."""
+        cfg = load_config()
+        if not cfg.get("ipc_enabled", True):
+            return
+        try:
+            self.ipc = ControlServer({
+                "/worker/start": self.start_worker,
+                "/worker/stop": lambda: self.stop_worker() or "stopped",
+                "/login": self.login_now,
+                "/profile/start": lambda: PROFILER.start() or "started",
+                "/profile/stop": lambda: str(PROFILER.stop() or ""),
+                "/panel/show": lambda: self.open_control_panel() or "shown",
+            }, port=cfg.get("ipc_port", DEFAULT_IPC_PORT))
+            self.ipc.start()
+        except Exception:
+            self.ipc = None
+            log.exception("Failed to start control API.")
+
+    def _set_role(self, role: str):
+        self.role = role
+        STATE.update(role=role)
+
+    def elect(self):
+        """Leader runs auto-login; followers mirror the leader (see instance.py)."""
+        if self.ipc is None:
+            self._set_role("standalone")
+        elif self.ipc.is_leader:
+            self._set_role("leader")
+        else:
+            self._set_role("follower")
+            self.follower = LeaderFollower(self.ipc.fixed_port, self._on_leader_lost)
+            self.follower.start()
+
+    def _on_leader_lost(self, follower):
+        # the event stream can end a moment before the old leader releases its port
+        for _ in range(5):
+            if self.ipc.try_promote(): break
+            time.sleep(0.5)
+        if self.ipc.is_leader:
+            self._set_role("leader")
+            log.info("👑 Took over as auto-login leader.")
+        elif follower.connected:
+            # another follower probably won the port; follow it instead
+            time.sleep(1)
+            self.follower = LeaderFollower(self.ipc.fixed_port, self._on_leader_lost)
+            self.follower.start()
+            return
+        else:
+            # port held by something that isn't us; run on our own
+            self._set_role("standalone")
+        self.follower = None
+        if load_config().get("auto_start_on_launch", True):
+            self.start_worker()
+
     def run(self):
         """Start the tray icon in a background thread, keep the Tk root mainloop running."""
+        # before the first-run wait, so a second launch meanwhile can reach us (/panel/show)
+        self.start_ipc()
+        self.elect()
+
         # If first-run or no username, show settings first
         cfg = load_config()
         if cfg.get("first_run", True) or not cfg.get("username"):
             # show settings on GUI thread and wait for it to be closed before continuing
             done = threading.Event()
+            @timed("tk.first_run")
             def _show_first_run():
                 SettingsWindow(self.tk_root, first_run=True)
                 done.set()
@@ -672,9 +845,11 @@ class TrayApp:
                 time.sleep(0.1)
 
         # run the tray icon in a separate thread (pystray will create its own message loop)
-        t = threading.Thread(target=self.icon.run, daemon=True)
+        t = threading.Thread(target=self.icon.run, name="tray", daemon=True)
         t.start()
-        
+
+        self.start_watchdog()
+
         try:
             cfg = load_config()
             if cfg.get("auto_start_on_launch", True):
@@ -684,8 +859,10 @@ class TrayApp:
             log.exception("Failed to start auto-login at launch.")
 
 # ---------- Entrypoint helper ----------
-def run_app():
+def run_app(profile: bool = False):
     # must create Tk root in main thread
+    if profile or load_config().get("profiling", False):
+        PROFILER.start()
     root = tk.Tk()
     root.withdraw()  # hidden root used for creating Toplevels
     app = TrayApp(root)